@@ -44,6 +44,22 @@ def main():
         help="<Optional> Name of the transcript file to be indexed. `mmu` or `hsa` can be passed so \
             the transcript will be downloaded automatically and index will be built.",
     )
+    parser.add_argument(
+        "--biotypes",
+        nargs="+",
+        required=False,
+        help="<Optional> Transcript biotypes kept when building the index from `transcript`, \
+            e.g. protein_coding lncRNA. Default: all biotypes.",
+        type=str,
+    )
+    parser.add_argument(
+        "--chromosomes",
+        nargs="+",
+        required=False,
+        help="<Optional> Chromosomes kept when building the index from `transcript`, e.g. 1 2 X Y MT. \
+            Default: every chromosome of the primary assembly, dropping patch and haplotype (CHR_*) transcripts.",
+        type=str,
+    )
     parser.add_argument(
         "-f",
         "--format",
@@ -67,6 +83,24 @@ def main():
         default="100",
         help="<Optional> Number of bootstrap samples. Default: 100.",
     )
+    parser.add_argument(
+        "--trim",
+        nargs="?",
+        required=False,
+        default="trim_galore",
+        choices=["trim_galore", "fastp"],
+        help="<Optional> Trimming engine. `fastp` trims adapters, filters by quality and writes the QC report in \
+            one multi-threaded pass, replacing the separate FastQC and Trim Galore runs. Default: trim_galore.",
+    )
+    parser.add_argument(
+        "--quant",
+        nargs="?",
+        required=False,
+        default="kallisto",
+        choices=["kallisto", "quick"],
+        help="<Optional> Quantification engine. `quick` uses the built-in k-mer pseudoalignment that needs no \
+            external binary, meant for quick screening and small panels (no bootstrap or BAM). Default: kallisto.",
+    )
     parser.add_argument(
         "--single",
         action="store_true",
@@ -79,6 +113,42 @@ def main():
         required=False,
         help="<Optional> Flag to indicate that will have extensive QC. **MAY NEED MORE FILES**",
     )
+    parser.add_argument(
+        "--resume",
+        nargs="?",
+        required=False,
+        help="<Optional> Path to a previous results folder to resume. Stages recorded as completed in its \
+            journal.log with matching checksums are skipped and only unfinished ones are run again.",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        nargs="?",
+        required=False,
+        type=int,
+        help="<Optional> Port for a local HTTP endpoint serving live run metrics in Prometheus text format. \
+            The same metrics are always written to metrics.prom inside the results folder.",
+    )
+    parser.add_argument(
+        "--scratch",
+        nargs="?",
+        required=False,
+        help="<Optional> Path to fast local storage (e.g. /tmp or a tmpfs) where raw reads are staged and \
+            intermediates are written for each sample. Only final results are moved to the results folder.",
+    )
+    parser.add_argument(
+        "--keep-intermediates",
+        action="store_true",
+        required=False,
+        help="<Optional> Flag to keep trimmed reads and pseudoalignment BAMs instead of deleting them once \
+            every stage using them has finished.",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        required=False,
+        help="<Optional> Flag for a dry run that predicts the time and peak memory of every stage from input \
+            sizes and the throughput recorded by earlier runs, and recommends threads for this machine.",
+    )
     parser.add_argument(
         "--json",
         nargs=1,
@@ -140,7 +210,19 @@ def main():
         min_len=args.min_len,
         quality=args.quality,
         ext_qc=args.ext_qc,
+        resume=args.resume,
+        metrics_port=args.metrics_port,
+        scratch=args.scratch,
+        keep_intermediates=args.keep_intermediates,
+        quant=args.quant,
+        trim=args.trim,
+        biotypes=args.biotypes,
+        chromosomes=args.chromosomes,
     )
+    if args.plan:
+        pipe.plan()
+        return
+
     pipe.run_full()  # min_len, quality, ext_qc, bootstrap, threads
 
     return
@@ -0,0 +1,54 @@
+import gzip
+import re
+
+COLUMNS = [
+    "target_id",
+    "target_version",
+    "ens_gene",
+    "ext_gene",
+    "gene_biotype",
+    "transcript_biotype",
+    "chromosome",
+    "description",
+]
+FIELD = re.compile(r"(\w+):(\S+)")
+
+
+def parse_header(header: str) -> dict:
+    """
+    Parse an Ensembl cDNA FASTA header, e.g.
+    `>ENST00000415118.1 cdna chromosome:GRCh38:14:22438547:22438554:1 gene:ENSG00000223997.1
+    gene_biotype:TR_D_gene transcript_biotype:TR_D_gene gene_symbol:TRDD1 description:T cell receptor ...`
+    :return: Dictionary with the annotation columns, versions stripped from Ensembl IDs
+    """
+    header = header.lstrip(">").strip()
+    header, _, description = header.partition(" description:")
+    target, _, rest = header.partition(" ")
+    fields = dict(FIELD.findall(rest))
+    target_id, _, target_version = target.partition(".")
+    location = fields.get("chromosome", fields.get("scaffold", "")).split(":")
+
+    return {
+        "target_id": target_id,
+        "target_version": target_version,
+        "ens_gene": fields.get("gene", "").split(".")[0],
+        "ext_gene": fields.get("gene_symbol", ""),
+        "gene_biotype": fields.get("gene_biotype", ""),
+        "transcript_biotype": fields.get("transcript_biotype", ""),
+        "chromosome": location[1] if len(location) > 1 else "",
+        "description": re.sub(r"\s*\[Source:.*\]$", "", description),
+    }
+
+
+def write_annotation(rows: list, path: str) -> int:
+    """
+    Write annotation rows as a gzipped table sorted by target_id
+    :return: Number of transcripts written
+    """
+    rows = sorted(rows, key=lambda row: row["target_id"])
+    with gzip.open(path, "wt") as fd:
+        fd.write("\t".join(COLUMNS) + "\n")
+        for row in rows:
+            fd.write("\t".join(row[col].replace("\t", " ") for col in COLUMNS) + "\n")
+
+    return len(rows)
@@ -0,0 +1,201 @@
+from pathlib import Path
+import sys
+
+
+class StageBackend:
+    # Name recorded in the journal and metrics, and binary checked before running
+    stage = None
+    binary = None
+    # Folder inside the results where the stage outputs are kept
+    folder = None
+    # File endings of outputs only needed by later stages
+    intermediates = ()
+    # Trimming backends that also write the QC report replace the QC stage
+    fused_qc = False
+    # Quantification backends able to write the pseudoalignment BAM read by the extensive QC
+    pseudobam = False
+    # Cost priors used by the planner until the history has runs of the stage:
+    # input bytes processed per second on one thread, fraction of the work that scales with threads,
+    # resident memory in MB and extra memory per byte of index
+    throughput = 10e6
+    parallel = 0.0
+    memory = 200
+    index_memory = 0.0
+
+    def __init__(self, options: dict) -> None:
+        """
+        Base class for the tool used in one stage of the pipeline.
+
+        :param options: pipeline settings (single, format, quality, min_len, threads, bootstrap, index, pseudobam)
+        :type options: dict
+        """
+        self.options = options
+        pass
+
+    def command(self, staging: str, sample: str, reads: list) -> list:
+        """
+        Build the command that writes every output of the stage inside `staging`
+        :param reads: one file for single-ended or both mates for paired-ended
+        :return: Command to be run
+        """
+        raise NotImplementedError
+
+    def outputs(self, folder: str, reads: list) -> list:
+        """
+        Intermediate reads written to `folder` and consumed by the next stage
+        :return: Paths of the written reads
+        """
+        return []
+
+    def _basename(self, read: str) -> str:
+        return Path(read).name[: -len(self.options["format"])]
+
+
+class FastQC(StageBackend):
+    stage = "fastqc"
+    binary = "fastqc"
+    folder = "1_quality_control"
+    throughput = 30e6
+    memory = 300
+
+    def command(self, staging: str, sample: str, reads: list) -> list:
+        return ["fastqc", "-o", staging, "--no-extract", *reads]
+
+
+class TrimGalore(StageBackend):
+    stage = "trim_galore"
+    binary = "trim_galore"
+    folder = "2_trimmed_output"
+    intermediates = (".fq.gz",)
+    throughput = 6e6
+    memory = 150
+
+    def command(self, staging: str, sample: str, reads: list) -> list:
+        paired = [] if self.options["single"] else ["--paired"]
+        return [
+            "trim_galore",
+            "--quality",
+            self.options["quality"],
+            "--fastqc",
+            "--length",
+            self.options["min_len"],
+            *paired,
+            "-o",
+            staging,
+            *reads,
+        ]
+
+    def outputs(self, folder: str, reads: list) -> list:
+        if self.options["single"]:
+            return [f"{folder}/{self._basename(reads[0])}_trimmed.fq.gz"]
+
+        return [
+            f"{folder}/{self._basename(read)}_val_{mate}.fq.gz"
+            for mate, read in enumerate(reads, start=1)
+        ]
+
+
+class Fastp(StageBackend):
+    stage = "fastp"
+    binary = "fastp"
+    folder = "2_trimmed_output"
+    intermediates = (".fq.gz",)
+    fused_qc = True
+    throughput = 25e6
+    parallel = 0.9
+    memory = 1000
+
+    def command(self, staging: str, sample: str, reads: list) -> list:
+        outputs = self.outputs(staging.rstrip("/"), reads)
+        if self.options["single"]:
+            files = ["-i", reads[0], "-o", outputs[0]]
+        else:
+            files = ["-i", reads[0], "-I", reads[1], "-o", outputs[0], "-O", outputs[1]]
+            files.append("--detect_adapter_for_pe")
+
+        # Adapter trimming, 3' quality trimming (as trim_galore --quality), read filtering and the QC report
+        # in one multi-threaded pass
+        return [
+            "fastp",
+            *files,
+            "--cut_tail",
+            "--cut_tail_mean_quality",
+            self.options["quality"],
+            "--qualified_quality_phred",
+            self.options["quality"],
+            "--length_required",
+            self.options["min_len"],
+            "--thread",
+            self.options["threads"],
+            "--html",
+            f"{staging}{sample}_fastp.html",
+            "--json",
+            f"{staging}{sample}_fastp.json",
+        ]
+
+    def outputs(self, folder: str, reads: list) -> list:
+        return [f"{folder}/{self._basename(read)}_fastp.fq.gz" for read in reads]
+
+
+class Kallisto(StageBackend):
+    stage = "kallisto"
+    binary = "kallisto"
+    folder = "3_kallisto_results"
+    intermediates = (".bam",)
+    pseudobam = True
+    throughput = 8e6
+    parallel = 0.85
+    memory = 300
+    index_memory = 1.1
+
+    def command(self, staging: str, sample: str, reads: list) -> list:
+        single = ["--single"] if self.options["single"] else []
+        # Pseudoalignments are only consumed by the extensive QC
+        pseudobam = ["--pseudobam"] if self.options["pseudobam"] else []
+        return [
+            "kallisto",
+            "quant",
+            "-t",
+            self.options["threads"],
+            "-b",
+            self.options["bootstrap"],
+            *pseudobam,
+            *single,
+            "-i",
+            f"index/{self.options['index']}",
+            "-o",
+            staging,
+            *reads,
+        ]
+
+
+class QuickQuant(StageBackend):
+    stage = "quickquant"
+    folder = "3_kallisto_results"
+    throughput = 0.3e6
+    parallel = 0.95
+    memory = 100
+    index_memory = 1.0
+
+    def command(self, staging: str, sample: str, reads: list) -> list:
+        single = ["--single"] if self.options["single"] else []
+        return [
+            sys.executable,
+            str(Path(__file__).with_name("quickquant.py")),
+            "quant",
+            "-t",
+            self.options["threads"],
+            *single,
+            "-i",
+            f"index/{self.options['index']}",
+            "-o",
+            staging,
+            *reads,
+        ]
+
+
+BACKENDS = {
+    "qc": {"fastqc": FastQC},
+    "trim": {"trim_galore": TrimGalore, "fastp": Fastp},
+    "quant": {"kallisto": Kallisto, "quick": QuickQuant},
+}
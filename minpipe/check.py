@@ -1,5 +1,9 @@
 from subprocess import run
 from pathlib import Path
+import sys
+
+from annotation import write_annotation
+from transcriptome import TranscriptomePreprocessor
 
 
 class TestSamples:
@@ -50,10 +54,15 @@ class TestSamples:
 
 
 class TestIndexTranscript:
-    def __init__(self, logger, transcript, index) -> None:
+    def __init__(
+        self, logger, transcript, index, quant="kallisto", biotypes=None, chromosomes=None
+    ) -> None:
         self.logger = logger
         self.transcript = transcript
         self.index = index
+        self.quant = quant
+        self.biotypes = biotypes
+        self.chromosomes = chromosomes
         pass
 
     def __download_hsa_transcript(self) -> None:
@@ -114,24 +123,59 @@ class TestIndexTranscript:
         else:
             idx_name = self.transcript.split(".")[0]
 
+        # Deduplicated and filtered transcriptome, streamed once and indexed instead of the raw FASTA
+        clean = f"index/{idx_name}.clean.fa"
+        preprocessor = TranscriptomePreprocessor(
+            self.logger,
+            biotypes=self.biotypes,
+            chromosomes=self.chromosomes,
+        )
+        rows = preprocessor.run(
+            f"index/{self.transcript[0]}", clean, f"index/{idx_name}.duplicates.tsv"
+        )
+        self.create_annotation(idx_name, rows)
+
+        if self.quant == "quick":
+            # Built-in k-mer index, used by the quick-quant engine instead of kallisto
+            idx_name = f"{idx_name}.quick"
+            cmd = [
+                sys.executable,
+                str(Path(__file__).with_name("quickquant.py")),
+                "index",
+            ]
+        else:
+            cmd = ["kallisto", "index"]
+
         idx = run(
             [
-                "kallisto",
-                "index",
+                *cmd,
                 "-i",
                 f"index/{idx_name}.idx",
-                f"index/{self.transcript[0]}",
+                clean,
             ],
             capture_output=True,
             text=True,
         )
         self.logger.info(idx.stdout)
         self.logger.info(idx.stderr)
+        Path(clean).unlink()
 
         self.index = [f"index/{idx_name}.idx"]
 
         pass
 
+    def create_annotation(self, idx_name: str, rows: list) -> None:
+        # Transcript to gene table read by minpipe.R instead of querying biomaRt
+        annotation = f"index/{idx_name}.annotation.tsv.gz"
+        if Path(annotation).is_file():
+            self.logger.info(f"Annotation found on {annotation}")
+            return
+
+        n_transcripts = write_annotation(rows, annotation)
+        self.logger.info(f"Annotation with {n_transcripts} transcripts written to {annotation}")
+
+        pass
+
     def check_idx_trans(self) -> None:
         if self.index is None and self.transcript is None:
             self.logger.info("No index or transcript has been passed")
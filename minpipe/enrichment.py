@@ -0,0 +1,210 @@
+"""
+Gene-set enrichment for every term and every contrast in one batch.
+
+Gene sets (e.g. KEGG and GO exported as GMT) are compiled once into a sparse term x gene matrix. Each run
+stacks the gene lists of all contrasts into a gene x contrast matrix, so the overlaps of all terms with all
+contrasts come from a single sparse product, followed by vectorized hypergeometric p-values and BH FDR.
+
+Usage:
+    python enrichment.py build -o index/mmu.genesets.npz kegg.gmt go.gmt
+    python enrichment.py run -s index/mmu.genesets.npz -t ann_de_filt_padj005_logfc1.tsv -p filtered_005 \
+        results/G1_G2 results/G1_G3
+"""
+from pathlib import Path
+import argparse
+import csv
+
+import numpy as np
+from scipy import sparse
+from scipy.stats import hypergeom
+
+
+def read_gmt(file: str):
+    with open(file) as fd:
+        for line in fd:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) > 2:
+                yield fields[0], fields[1], [gene for gene in fields[2:] if gene]
+
+
+def build_store(gmt_files: list, path: str) -> None:
+    """
+    Compile GMT files into a sparse term x gene matrix. The GMT file name (e.g. kegg.gmt) is kept as source
+    :return: Writes the store to `path`
+    """
+    ids, descriptions, sources, members = [], [], [], []
+    for file in gmt_files:
+        for term, description, genes in read_gmt(file):
+            ids.append(term)
+            descriptions.append(description)
+            sources.append(Path(file).name.split(".")[0])
+            members.append(set(genes))
+
+    genes = np.array(sorted(set().union(*members)))
+    position = {gene: i for i, gene in enumerate(genes)}
+    indptr = np.cumsum([0] + [len(m) for m in members])
+    indices = np.fromiter(
+        (position[gene] for m in members for gene in sorted(m, key=position.get)),
+        dtype=np.int32,
+        count=int(indptr[-1]),
+    )
+
+    np.savez(
+        path,
+        genes=genes,
+        ids=np.array(ids),
+        descriptions=np.array(descriptions),
+        sources=np.array(sources),
+        indptr=indptr,
+        indices=indices,
+    )
+
+    pass
+
+
+class GeneSetStore:
+    def __init__(self, path: str) -> None:
+        """
+        Term x gene membership loaded from a store written by `build_store`.
+
+        :type path: str
+        """
+        self.path = path
+        with np.load(path) as store:
+            self.genes = store["genes"]
+            self.ids = store["ids"]
+            self.descriptions = store["descriptions"]
+            self.sources = store["sources"]
+            indptr, indices = store["indptr"], store["indices"]
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.int32), indices, indptr),
+            shape=(len(self.ids), len(self.genes)),
+        )
+        self.position = {gene: i for i, gene in enumerate(self.genes)}
+        pass
+
+    def enrich(self, gene_lists: dict, min_size: int = 10, max_size: int = 500) -> dict:
+        """
+        Hypergeometric enrichment of every term for every gene list at once, same defaults as clusterProfiler
+        :param gene_lists: contrast name -> list of gene IDs
+        :return: contrast name -> {source -> rows with overlap sorted by p-value}
+        """
+        names = list(gene_lists)
+        hits = sparse.lil_matrix((len(self.genes), len(names)), dtype=np.int32)
+        for col, name in enumerate(names):
+            rows = sorted({self.position[g] for g in gene_lists[name] if g in self.position})
+            hits[rows, col] = 1
+        hits = hits.tocsc()
+
+        overlap = np.asarray((self.matrix @ hits).todense())
+        term_size = np.asarray(self.matrix.sum(axis=1)).ravel()
+        results = {name: {} for name in names}
+
+        for source in np.unique(self.sources):
+            in_source = self.sources == source
+            terms = np.flatnonzero(in_source & (term_size >= min_size) & (term_size <= max_size))
+            if terms.size == 0:
+                continue
+
+            # As in clusterProfiler, the universe is every gene annotated to any term of this source, before
+            # the size filter that only chooses the terms to be tested
+            annotated = np.asarray(self.matrix[np.flatnonzero(in_source)].sum(axis=0)).ravel() > 0
+            universe = int(annotated.sum())
+            listed = np.asarray(hits[annotated].sum(axis=0)).ravel()
+
+            k = overlap[terms]
+            big_k = term_size[terms][:, None]
+            pvalues = hypergeom.sf(k - 1, universe, big_k, listed[None, :])
+            # As in clusterProfiler, only terms sharing at least one gene with the list are tested
+            padj = self.__benjamini_hochberg(pvalues, k > 0)
+
+            for col, name in enumerate(names):
+                keep = np.flatnonzero(k[:, col] > 0)
+                keep = keep[np.argsort(pvalues[keep, col], kind="stable")]
+                listed_genes = set(hits[:, col].nonzero()[0])
+                rows = []
+                for i in keep:
+                    term = terms[i]
+                    members = self.matrix.indices[self.matrix.indptr[term]:self.matrix.indptr[term + 1]]
+                    rows.append(
+                        {
+                            "ID": self.ids[term],
+                            "Description": self.descriptions[term],
+                            "GeneRatio": f"{k[i, col]}/{listed[col]}",
+                            "BgRatio": f"{term_size[term]}/{universe}",
+                            "pvalue": pvalues[i, col],
+                            "p.adjust": padj[i, col],
+                            "geneID": "/".join(self.genes[g] for g in members if g in listed_genes),
+                            "Count": int(k[i, col]),
+                        }
+                    )
+                results[name][source] = rows
+
+        return results
+
+    @staticmethod
+    def __benjamini_hochberg(pvalues: np.ndarray, tested: np.ndarray) -> np.ndarray:
+        # Column-wise BH adjustment over the tested terms only, untested ones are left as NaN
+        pvalues = np.where(tested, pvalues, np.nan)
+        order = np.argsort(pvalues, axis=0)
+        ranks = np.arange(1, pvalues.shape[0] + 1)[:, None]
+        ranked = np.take_along_axis(pvalues, order, axis=0) * tested.sum(axis=0) / ranks
+        ranked = np.fmin.accumulate(ranked[::-1], axis=0)[::-1]
+        padj = np.empty_like(ranked)
+        np.put_along_axis(padj, order, np.minimum(ranked, 1.0), axis=0)
+
+        return padj
+
+
+def read_gene_list(table: str, column: str = "entrez_id") -> list:
+    with open(table) as fd:
+        return [
+            row[column]
+            for row in csv.DictReader(fd, delimiter="\t")
+            if row.get(column) not in (None, "", "NA")
+        ]
+
+
+def write_table(rows: list, path: str) -> None:
+    columns = ["ID", "Description", "GeneRatio", "BgRatio", "pvalue", "p.adjust", "geneID", "Count"]
+    with open(path, "w", newline="") as fd:
+        writer = csv.DictWriter(fd, fieldnames=columns, delimiter="\t", lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch gene-set enrichment over all contrasts.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Compile GMT files into a gene-set store.")
+    build.add_argument("-o", "--output", required=True, help="Path of the store (.npz) to be written.")
+    build.add_argument("gmt", nargs="+", help="GMT files, the file name is used as source (e.g. kegg.gmt).")
+
+    run = commands.add_parser("run", help="Enrich the DE table of every contrast folder.")
+    run.add_argument("-s", "--store", required=True, help="Gene-set store written by `build`.")
+    run.add_argument("-t", "--table", required=True, help="DE table name inside each contrast folder.")
+    run.add_argument("-p", "--prefix", required=True, help="Prefix of the written tables.")
+    run.add_argument("-c", "--column", default="entrez_id", help="Gene ID column. Default: entrez_id.")
+    run.add_argument("folders", nargs="+", help="Contrast folders.")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        build_store(args.gmt, args.output)
+        return
+
+    store = GeneSetStore(args.store)
+    gene_lists = {
+        folder: read_gene_list(str(Path(folder) / args.table), args.column) for folder in args.folders
+    }
+    for folder, sources in store.enrich(gene_lists).items():
+        for source, rows in sources.items():
+            path = Path(folder) / f"{args.prefix}__{source}_full_table.txt"
+            write_table(rows, str(path))
+            print(f"Saved {path}")
+
+
+if __name__ == "__main__":
+    main()
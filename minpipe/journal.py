@@ -0,0 +1,139 @@
+from datetime import datetime
+from hashlib import sha256
+from pathlib import Path
+import logging
+import json
+import os
+
+
+class RunJournal:
+    def __init__(self, output: str, logger: logging.Logger = None) -> None:
+        """
+        Append-only journal of stage events kept inside the results folder so an interrupted run can be resumed.
+
+        Every line is a Json record with `event` (start, done, failed or cleaned), `stage`, `sample` and, for
+        `done`, the sha256 of every output written by the stage. Outputs inside the results folder are kept
+        relative to it and outputs in a scratch folder are kept as absolute paths. `cleaned` lists intermediate
+        outputs deleted after every consumer finished, which are no longer verified on resume. Every absolute path
+        ever recorded is kept in `external` so outputs left on scratch by earlier runs can be found.
+
+        :type output: str
+        :type logger: logging.Logger
+        """
+        self.output = output
+        self.logger = logger
+        self.path = f"{self.output}journal.log"
+        self.completed = {}
+        self.external = set()
+        pass
+
+    def load(self) -> None:
+        """
+        Replay the journal so the last event of every stage/sample pair is known
+        :return: None
+        """
+        if not Path(self.path).is_file():
+            return
+
+        with open(self.path) as fd:
+            for line in fd:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Last line may be torn if the job was killed while writing it
+                    continue
+
+                key = (record["stage"], record["sample"])
+                if record["event"] == "done":
+                    self.completed[key] = record["outputs"]
+                    self.external.update(file for file in record["outputs"] if Path(file).is_absolute())
+                elif record["event"] == "cleaned":
+                    for file in record["outputs"]:
+                        self.completed.get(key, {}).pop(file, None)
+                else:
+                    self.completed.pop(key, None)
+
+        self.logger.info(
+            f"Journal loaded from {self.path}: {len(self.completed)} stages completed."
+        )
+
+        pass
+
+    def __write(self, record: dict) -> None:
+        record["time"] = str(datetime.now().strftime("%d-%m-%Y_%H-%M-%S"))
+        with open(self.path, "a") as fd:
+            fd.write(json.dumps(record) + "\n")
+            fd.flush()
+            os.fsync(fd.fileno())
+
+        pass
+
+    def __key(self, file: str) -> str:
+        try:
+            return str(Path(file).relative_to(self.output))
+        except ValueError:
+            return str(Path(file).resolve())
+
+    def __path(self, key: str) -> str:
+        return key if Path(key).is_absolute() else f"{self.output}{key}"
+
+    @staticmethod
+    def checksum(file: str) -> str:
+        digest = sha256()
+        with open(file, "rb") as fd:
+            for chunk in iter(lambda: fd.read(1 << 20), b""):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+    def start(self, stage: str, sample: str) -> None:
+        self.completed.pop((stage, sample), None)
+        self.__write({"event": "start", "stage": stage, "sample": sample})
+
+        pass
+
+    def failed(self, stage: str, sample: str) -> None:
+        self.__write({"event": "failed", "stage": stage, "sample": sample})
+
+        pass
+
+    def done(self, stage: str, sample: str, outputs: list) -> None:
+        """
+        Record a finished stage with the checksum of each file it wrote
+        :param outputs: paths of the files written by the stage
+        :return: None
+        """
+        checksums = {self.__key(file): self.checksum(file) for file in outputs}
+        self.completed[(stage, sample)] = checksums
+        self.__write(
+            {"event": "done", "stage": stage, "sample": sample, "outputs": checksums}
+        )
+
+        pass
+
+    def cleaned(self, stage: str, sample: str, outputs: list) -> None:
+        keys = [self.__key(file) for file in outputs]
+        for key in keys:
+            self.completed.get((stage, sample), {}).pop(key, None)
+        self.__write({"event": "cleaned", "stage": stage, "sample": sample, "outputs": keys})
+
+        pass
+
+    def is_complete(self, stage: str, sample: str) -> bool:
+        """
+        Check if a stage has been recorded as done and all its outputs still match their checksums
+        :return: True when the stage can be skipped
+        """
+        outputs = self.completed.get((stage, sample))
+        if outputs is None:
+            return False
+
+        for file, digest in outputs.items():
+            path = self.__path(file)
+            if not Path(path).is_file() or self.checksum(path) != digest:
+                self.logger.info(
+                    f"Output {file} of {stage} for {sample} is missing or changed. Running it again."
+                )
+                return False
+
+        return True
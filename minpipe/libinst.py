@@ -1,10 +1,12 @@
 from subprocess import run
+from shutil import which
 from pathlib import Path
 
 
 class CheckLibs:
-    def __init__(self, logger) -> None:
+    def __init__(self, logger, tools=None) -> None:
         self.logger = logger
+        self.tools = tools if tools is not None else ["fastqc", "trim_galore", "kallisto"]
         pass
 
     def __check_kallisto(self) -> None:
@@ -43,7 +45,20 @@ class CheckLibs:
             self.logger.info("EXITING")
             exit()
 
+    def __check_fastp(self) -> None:
+        if which("fastp") is not None:
+            self.logger.info("Contains fastp? Yes")
+        else:
+            self.logger.info("Contains fastp? No")
+            self.logger.info("EXITING")
+            exit()
+
     def check_all(self) -> None:
-        self.__check_fastqc()
-        self.__check_trim_galore()
-        self.__check_kallisto()
+        if "fastqc" in self.tools:
+            self.__check_fastqc()
+        if "trim_galore" in self.tools:
+            self.__check_trim_galore()
+        if "fastp" in self.tools:
+            self.__check_fastp()
+        if "kallisto" in self.tools:
+            self.__check_kallisto()
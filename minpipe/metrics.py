@@ -0,0 +1,243 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import time
+import logging
+import os
+import re
+
+
+class ProgressMetrics:
+    # Progress lines printed by the tools while they run
+    FASTQC_PERCENT = re.compile(r"Approx (\d+)% complete")
+    CUTADAPT_READS = re.compile(r"Total (?:reads|read pairs) processed:\s+([\d,]+)")
+    # e.g. `00:00:03     1,000,000 reads  @      3.1 µs/read;  19.33 M reads/minute`, only printed by cutadapt
+    # when its stderr is a terminal, otherwise trim_galore reports the total of each file when it is done
+    CUTADAPT_PROGRESS = re.compile(r"([\d,]+) (?:reads|read pairs)\s+@")
+    KALLISTO_READS = re.compile(r"\[quant\] processed ([\d,]+) reads")
+    # fastp prints the totals of each mate before and after filtering, under a `Read1 before filtering:` header
+    FASTP_SECTION = re.compile(r"^Read\d (before|after) filtering:")
+    FASTP_READS = re.compile(r"^total reads: (\d+)")
+
+    def __init__(
+        self,
+        output: str,
+        samples: list,
+        stages: list,
+        logger: logging.Logger = None,
+        port: int = None,
+    ) -> None:
+        """
+        Keep live progress of the run and publish it as a Prometheus text file (and HTTP endpoint if `port` is given).
+
+        :type output: str
+        :type samples: list
+        :type stages: list
+        :type logger: logging.Logger
+        :type port: int
+        """
+        self.output = output
+        self.samples = samples
+        self.stages = stages
+        self.logger = logger
+        self.port = port
+        self.path = f"{self.output}metrics.prom"
+        self.lock = Lock()
+        self.start_time = time()
+        self.last_update = self.start_time
+        self.pending = {stage: len(samples) for stage in stages}
+        self.reads = {stage: 0 for stage in stages}
+        self.busy = {stage: 0.0 for stage in stages}
+        self.running = {}
+        self.done = 0
+        self.sample_times = []
+        self.sample_start = {}
+        self.last_write = 0.0
+        self.server = None
+        pass
+
+    def start(self) -> None:
+        if self.port is not None:
+            metrics = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = metrics.render().encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer(("127.0.0.1", int(self.port)), Handler)
+            Thread(target=self.server.serve_forever, daemon=True).start()
+            self.logger.info(f"Metrics served on http://127.0.0.1:{self.port}/metrics")
+
+        self.write()
+
+        pass
+
+    def stop(self) -> None:
+        self.write()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server = None
+
+        pass
+
+    def stage_started(self, stage: str, sample: str) -> None:
+        with self.lock:
+            self.sample_start.setdefault(sample, time())
+            self.running[stage] = {
+                "sample": sample,
+                "start": time(),
+                "reads": 0,
+                "files": 0,
+                "file": 0,
+                "progress": 0.0,
+            }
+            self.last_update = time()
+        self.write()
+
+        pass
+
+    def stage_finished(self, stage: str, sample: str) -> None:
+        with self.lock:
+            current = self.running.pop(stage, None)
+            if current is not None:
+                self.reads[stage] += current["reads"]
+                self.busy[stage] += time() - current["start"]
+            self.pending[stage] = max(self.pending[stage] - 1, 0)
+            self.last_update = time()
+        self.write()
+
+        pass
+
+    def sample_finished(self, sample: str) -> None:
+        with self.lock:
+            self.done += 1
+            started = self.sample_start.pop(sample, None)
+            if started is not None:
+                self.sample_times.append(time() - started)
+            self.last_update = time()
+        self.write()
+
+        pass
+
+    def parse_line(self, stage: str, line: str) -> None:
+        """
+        Update the running stage with any progress information found in a line of tool output
+        :return: None
+        """
+        percent = self.FASTQC_PERCENT.search(line)
+        total = self.CUTADAPT_READS.search(line)
+        progress = self.CUTADAPT_PROGRESS.search(line)
+        section = self.FASTP_SECTION.search(line)
+        mate = self.FASTP_READS.search(line)
+        reads = self.KALLISTO_READS.search(line)
+
+        if all(match is None for match in [percent, total, progress, section, mate, reads]):
+            return
+
+        with self.lock:
+            current = self.running.get(stage)
+            if current is None:
+                return
+            if percent is not None:
+                current["progress"] = int(percent.group(1)) / 100
+            if section is not None:
+                current["section"] = section.group(1)
+            # trim_galore runs cutadapt once per file and fastp reports each mate, so the reads of R1 and R2
+            # add up for every trimming backend
+            if total is not None or (mate is not None and current.get("section") == "before"):
+                current["files"] += int((total or mate).group(1).replace(",", ""))
+                current["file"] = 0
+            elif progress is not None:
+                current["file"] = int(progress.group(1).replace(",", ""))
+            if reads is not None:
+                current["reads"] = max(current["reads"], int(reads.group(1).replace(",", "")))
+            current["reads"] = max(current["reads"], current["files"] + current["file"])
+            self.last_update = time()
+
+        # Progress bars may print many times per second, so the file is refreshed at most once a second
+        if self.last_update - self.last_write >= 1:
+            self.write()
+
+        pass
+
+    def render(self) -> str:
+        with self.lock:
+            now = time()
+            done = self.done
+            remaining = len(self.samples) - done
+            if self.sample_times:
+                eta = f"{sum(self.sample_times) / len(self.sample_times) * remaining:.1f}"
+            else:
+                eta = "NaN"
+
+            lines = [
+                "# HELP minpipe_samples_done Samples with every stage finished.",
+                "# TYPE minpipe_samples_done gauge",
+                f"minpipe_samples_done {done}",
+                "# HELP minpipe_samples_remaining Samples still to be finished.",
+                "# TYPE minpipe_samples_remaining gauge",
+                f"minpipe_samples_remaining {remaining}",
+                "# HELP minpipe_eta_seconds Estimated seconds until the run finishes.",
+                "# TYPE minpipe_eta_seconds gauge",
+                f"minpipe_eta_seconds {eta}",
+                "# HELP minpipe_last_update_seconds Seconds since the last progress was seen.",
+                "# TYPE minpipe_last_update_seconds gauge",
+                f"minpipe_last_update_seconds {now - self.last_update:.1f}",
+                "# HELP minpipe_stage_queue_depth Samples waiting for a stage, including the running one.",
+                "# TYPE minpipe_stage_queue_depth gauge",
+            ]
+            lines += [
+                f'minpipe_stage_queue_depth{{stage="{stage}"}} {self.pending[stage]}'
+                for stage in self.stages
+            ]
+
+            lines += [
+                "# HELP minpipe_reads_processed_total Reads processed by a stage.",
+                "# TYPE minpipe_reads_processed_total counter",
+            ]
+            rates = []
+            for stage in self.stages:
+                reads = self.reads[stage]
+                busy = self.busy[stage]
+                current = self.running.get(stage)
+                if current is not None:
+                    reads += current["reads"]
+                    busy += now - current["start"]
+                lines.append(f'minpipe_reads_processed_total{{stage="{stage}"}} {reads}')
+                rates.append(
+                    f'minpipe_reads_per_second{{stage="{stage}"}} {reads / busy if busy else 0:.1f}'
+                )
+
+            lines += [
+                "# HELP minpipe_reads_per_second Reads processed per second of stage run time.",
+                "# TYPE minpipe_reads_per_second gauge",
+            ] + rates
+
+            lines += [
+                "# HELP minpipe_stage_progress_ratio Reported progress of the running stage.",
+                "# TYPE minpipe_stage_progress_ratio gauge",
+            ]
+            lines += [
+                f'minpipe_stage_progress_ratio{{stage="{stage}",sample="{current["sample"]}"}} '
+                f'{current["progress"]:.2f}'
+                for stage, current in self.running.items()
+            ]
+
+        return "\n".join(lines) + "\n"
+
+    def write(self) -> None:
+        # Written to a temporary file and renamed so scrapers never read half a file
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as fd:
+            fd.write(self.render())
+        os.replace(tmp, self.path)
+        self.last_write = time()
+
+        pass
@@ -13,7 +13,9 @@ def yaml_parse(yml_file: str = None):
     tbp = []
     for index, value in enumerate(fnl):
         if value in ["samples", "complement", "index", "transcript", \
-                     "threads", "bootstrap", "single", "ext-qc"]:
+                     "threads", "bootstrap", "single", "ext-qc", "resume", "metrics-port",
+                     "scratch", "keep-intermediates", "quant", "trim", "plan",
+                     "biotypes", "chromosomes"]:
             fnl[index] = f"--{value}"
 
         if value == "true":
@@ -1,12 +1,21 @@
-from subprocess import run
+from subprocess import run, Popen, PIPE, STDOUT
 from datetime import datetime
 from pathlib import Path
-from os import makedirs
+from errno import EXDEV
+from hashlib import sha256
+from os import makedirs, replace, wait4, waitstatus_to_exitcode
+from shutil import copyfile, move, rmtree
+from tempfile import mkdtemp
+from time import time
 import logging
 import warnings
 
+from backends import BACKENDS
 from check import TestIndexTranscript, TestSamples
+from journal import RunJournal
 from libinst import CheckLibs
+from metrics import ProgressMetrics
+from planner import CostModel, ExecutionPlan, machine_resources
 from quality import ExtensiveQC
 
 
@@ -27,6 +36,14 @@ class PipelineCreator:
         min_len: int = 25,
         quality: int = 20,
         ext_qc: bool = False,
+        resume: str = None,
+        metrics_port: int = None,
+        scratch: str = None,
+        keep_intermediates: bool = False,
+        quant: str = "kallisto",
+        trim: str = "trim_galore",
+        biotypes: list = None,
+        chromosomes: list = None,
     ) -> None:
         """
         Construct the PipelineCreator object to run full pipeline writing results to parameter/default folder.
@@ -45,6 +62,14 @@ class PipelineCreator:
         :type ext_qc: bool
         :type output_path: str
         :type input_path: str
+        :type resume: str
+        :type metrics_port: int
+        :type scratch: str
+        :type keep_intermediates: bool
+        :type quant: str
+        :type trim: str
+        :type biotypes: list
+        :type chromosomes: list
         """
         self.single = single
         self.complement = complement
@@ -60,6 +85,20 @@ class PipelineCreator:
         self.quality = str(quality)
         self.ext_qc = ext_qc
         self.logger = logger
+        self.resume = resume
+        self.journal = None
+        self.metrics_port = metrics_port
+        self.metrics = None
+        self.scratch = scratch
+        self.keep_intermediates = keep_intermediates
+        self.staged = {}
+        self.quantified = set()
+        self.quant = quant
+        self.trim = trim
+        self.biotypes = biotypes
+        self.chromosomes = chromosomes
+        self.backends = None
+        self.cost_model = None
         self.curr_time = str(datetime.now().strftime("%d-%m-%Y_%H-%M-%S"))
         # self.format, if format is passed then no decide_format needed
         # self.input where is passed input path to sample files
@@ -84,7 +123,12 @@ class PipelineCreator:
                 Path(self.input).is_dir() is True
             ), f"Input path should be a valid path. Passed `{self.input}`"
 
-        if self.output is None:
+        if self.resume is not None:
+            self.output = self.resume if self.resume[-1] == "/" else f"{self.resume}/"
+            assert (
+                Path(f"{self.output}journal.log").is_file() is True
+            ), f"Resume path should be a previous results folder with a journal.log. Passed `{self.resume}`"
+        elif self.output is None:
             self.output = f"results_{self.curr_time}/"
         else:
             if self.output[-1] == "/":
@@ -108,9 +152,14 @@ class PipelineCreator:
         print(f"Samples: {self.samples}")
         print(f"File format: {self.format}")
         print(f"Output path: {self.output}")
+        print(f"Resuming run? {self.resume is not None}")
         print(f"Input path: {self.input}")
+        print(f"Scratch path: {self.scratch}")
+        print(f"Keep intermediates? {self.keep_intermediates}")
         print(f"Index used: {self.index}")
         print(f"Threads used: {self.threads}")
+        print(f"Trimming engine: {self.trim}")
+        print(f"Quantification engine: {self.quant}")
         print(f"Quantification bootstrap: {self.bootstrap}")
         print(f"Minimum length of trimmage: {self.min_len}")
         print(f"Minimum quality of trimmage: {self.quality}")
@@ -144,7 +193,11 @@ class PipelineCreator:
         self.logger.info(f"Complements: {self.complement}")
         self.logger.info(f"Index: {self.index}")
         self.logger.info(f"Transcript: {self.transcript}")
+        self.logger.info(f"Transcript biotypes kept: {self.biotypes}")
+        self.logger.info(f"Transcript chromosomes kept: {self.chromosomes}")
         self.logger.info(f"Threads number: {self.threads}")
+        self.logger.info(f"Trimming engine: {self.trim}")
+        self.logger.info(f"Quantification engine: {self.quant}")
         self.logger.info(f"Bootstrap number: {self.bootstrap}")
         self.logger.info(f"Single ended: {self.single}")
         self.logger.info(f"Extensive Quality Control: {self.ext_qc}")
@@ -152,12 +205,23 @@ class PipelineCreator:
         self.logger.info(f"Minimum length for trimmage: {self.min_len}")
         self.logger.info(f"Input path: {self.input}")
         self.logger.info(f"Output path: {self.output}")
+        self.logger.info(f"Resuming from: {self.resume}")
+        self.logger.info(f"Scratch path: {self.scratch}")
+        self.logger.info(f"Keep intermediates: {self.keep_intermediates}")
 
-        lib_is_installed = CheckLibs(self.logger)
+        lib_is_installed = CheckLibs(
+            self.logger,
+            tools=[backend.binary for backend in self.__backend_classes().values()],
+        )
         lib_is_installed.check_all()
 
         test_index_transc = TestIndexTranscript(
-            self.logger, transcript=self.transcript, index=self.index
+            self.logger,
+            transcript=self.transcript,
+            index=self.index,
+            quant=self.quant,
+            biotypes=self.biotypes,
+            chromosomes=self.chromosomes,
         )
         index = test_index_transc.check_idx_trans()
         if ".idx" in index:
@@ -189,6 +253,8 @@ class PipelineCreator:
             self.logger.info(f"Index: {self.index}")
             self.logger.info(f"Transcript: {self.transcript}")
             self.logger.info(f"Threads number: {self.threads}")
+            self.logger.info(f"Trimming engine: {self.trim}")
+            self.logger.info(f"Quantification engine: {self.quant}")
             self.logger.info(f"Bootstrap number: {self.bootstrap}")
             self.logger.info(f"Single ended: {self.single}")
             self.logger.info(f"Extensive Quality Control: {self.ext_qc}")
@@ -196,141 +262,232 @@ class PipelineCreator:
             self.logger.info(f"Minimum length for trimmage: {self.min_len}")
             self.logger.info(f"Input path: {self.input}")
             self.logger.info(f"Output path: {self.output}")
+            self.logger.info(f"Resuming from: {self.resume}")
+            self.logger.info(f"Scratch path: {self.scratch}")
+            self.logger.info(f"Keep intermediates: {self.keep_intermediates}")
 
         pass
 
-    def __run_paired(self) -> None:
+    def __workdir(self, sample: str) -> str:
+        # Named after the results folder, not the start time, so a resumed run finds the intermediates it journaled
+        run_id = sha256(str(Path(self.output).resolve()).encode()).hexdigest()[:12]
+        workdir = f"{Path(self.scratch) / f'minpipe_{run_id}_{sample}'}/"
+        makedirs(workdir, exist_ok=True)
+
+        return workdir
+
+    def __local_dir(self, sample: str, folder: str) -> str:
         """
-        Run paired-ended analysis using current tools
-        :return: Writes quality control, trimmed plus quality control and kallisto abundance/BAM results
+        Folder for intermediate outputs, kept on scratch storage when `--scratch` is used unless they are kept
+        :return: Path without trailing slash
         """
-        for sample in self.samples:
-            qc = run(
-                [
-                    "fastqc",
-                    "-o",
-                    f"{self.output}1_quality_control",
-                    "--no-extract",
-                    f"{self.input}{sample}{self.complement[0]}{self.format}",
-                    f"{self.input}{sample}{self.complement[1]}{self.format}",
-                ],
-                capture_output=True,
-                text=True,
-            )
-            self.logger.info(qc.stdout)
-            self.logger.info(qc.stderr)
-
-            trim = run(
-                [
-                    "trim_galore",
-                    "--quality",
-                    self.quality,
-                    "--fastqc",
-                    "--length",
-                    self.min_len,
-                    "--paired",
-                    "-o",
-                    f"{self.output}2_trimmed_output",
-                    f"{self.input}{sample}{self.complement[0]}{self.format}",
-                    f"{self.input}{sample}{self.complement[1]}{self.format}",
-                ],
-                capture_output=True,
-                text=True,
-            )
-            self.logger.info(trim.stdout)
-            self.logger.info(trim.stderr)
+        if self.scratch is None or self.keep_intermediates:
+            return f"{self.output}{folder}"
 
-            run(
-                ["mkdir", "-p", f"results_{self.curr_time}/3_kallisto_results/{sample}"]
-            )
+        return f"{self.__workdir(sample)}{folder}"
 
-            kall = run(
-                [
-                    "kallisto",
-                    "quant",
-                    "-t",
-                    self.threads[0],
-                    "-b",
-                    self.bootstrap[0],
-                    "-i",
-                    f"index/{self.index[0]}",
-                    "-o",
-                    f"{self.output}3_kallisto_results/{sample}",
-                    "--pseudobam",
-                    f"{self.output}2_trimmed_output/{sample}{self.complement[0]}_val_1.fq.gz",
-                    f"{self.output}2_trimmed_output/{sample}{self.complement[1]}_val_2.fq.gz",
-                ],
-                capture_output=True,
-                text=True,
+    def __stage_inputs(self, sample: str, files: list) -> list:
+        """
+        Copy the raw reads of a sample to scratch storage the first time a stage needs them
+        :return: Paths of the reads to be used by the tools
+        """
+        if self.scratch is None:
+            return [f"{self.input}{file}" for file in files]
+
+        if sample not in self.staged:
+            local = f"{self.__workdir(sample)}input/"
+            makedirs(local, exist_ok=True)
+            for file in files:
+                copyfile(f"{self.input}{file}", f"{local}{file}")
+            self.staged[sample] = [f"{local}{file}" for file in files]
+
+        return self.staged[sample]
+
+    def __drop_inputs(self, sample: str) -> None:
+        if self.staged.pop(sample, None) is not None:
+            rmtree(f"{self.__workdir(sample)}input", ignore_errors=True)
+
+        pass
+
+    def __release(self, stage: str, sample: str, files: list) -> None:
+        """
+        Delete intermediate outputs of a stage once every consumer has finished with them
+        :return: None
+        """
+        if self.keep_intermediates:
+            return
+
+        removed = [file for file in files if Path(file).is_file()]
+        for file in removed:
+            Path(file).unlink()
+        if removed:
+            self.journal.cleaned(stage, sample, removed)
+            self.logger.info(f"Removed intermediates of {stage} for {sample}: {removed}")
+
+        pass
+
+    @staticmethod
+    def __move(source: Path, target: Path) -> None:
+        try:
+            replace(source, target)
+        except OSError as err:
+            if err.errno != EXDEV:
+                raise
+            # Scratch and results are on different filesystems, copy next to the target then rename
+            part = target.with_name(f".{target.name}.part")
+            move(str(source), str(part))
+            replace(part, target)
+
+        pass
+
+    def __run_stage(
+        self,
+        stage: str,
+        sample: str,
+        destination: str,
+        command,
+        intermediates: tuple = (),
+        local: str = None,
+        inputs: list = None,
+    ) -> bool:
+        """
+        Run one stage for one sample writing into a staging folder that is moved into `destination` on success
+        :param stage: name recorded in the journal
+        :param destination: final folder for the stage outputs
+        :param command: callable receiving the staging folder and returning the command to be run
+        :param intermediates: file endings of outputs only needed by later stages
+        :param local: folder for the intermediates, `destination` if not given
+        :param inputs: files read by the stage, their size is recorded with the run time for the planner
+        :return: True if the stage is completed
+        """
+        if self.journal.is_complete(stage, sample):
+            self.logger.info(f"Skipping {stage} for {sample}: already completed.")
+            self.metrics.stage_finished(stage, sample)
+            return True
+
+        staging = mkdtemp(
+            prefix=f".staging_{stage}_{sample}_",
+            dir=self.output if self.scratch is None else self.__workdir(sample),
+        )
+        self.journal.start(stage, sample)
+        self.metrics.stage_started(stage, sample)
+
+        # Output is read as it arrives so progress can be published while the tool runs
+        lines = []
+        started = time()
+        with Popen(command(f"{staging}/"), stdout=PIPE, stderr=STDOUT, text=True) as proc:
+            for line in proc.stdout:
+                lines.append(line)
+                self.metrics.parse_line(stage, line)
+            # Reaped here to get the resource usage of this stage only
+            _, status, usage = wait4(proc.pid, 0)
+            proc.returncode = waitstatus_to_exitcode(status)
+        seconds = time() - started
+        self.logger.info("".join(lines))
+        self.metrics.stage_finished(stage, sample)
+
+        if proc.returncode != 0:
+            self.logger.info(f"{stage} failed for {sample} with code {proc.returncode}.")
+            self.journal.failed(stage, sample)
+            rmtree(staging, ignore_errors=True)
+            return False
+
+        makedirs(destination, exist_ok=True)
+        if local is not None:
+            makedirs(local, exist_ok=True)
+        outputs = []
+        for item in sorted(Path(staging).iterdir()):
+            if item.name.endswith(intermediates) and local is not None:
+                target = Path(local) / item.name
+            else:
+                target = Path(destination) / item.name
+            if target.is_dir():
+                rmtree(target)
+            self.__move(item, target)
+            if target.is_dir():
+                outputs += [str(f) for f in sorted(target.rglob("*")) if f.is_file()]
+            else:
+                outputs.append(str(target))
+        rmtree(staging, ignore_errors=True)
+
+        self.journal.done(stage, sample, outputs)
+
+        if inputs:
+            self.cost_model.record(
+                stage,
+                sum(Path(file).stat().st_size for file in inputs if Path(file).is_file()),
+                seconds,
+                int(self.threads),
+                usage.ru_maxrss / 1024,
+                self.__index_size(),
             )
-            self.logger.info(kall.stdout)
-            self.logger.info(kall.stderr)
+
+        return True
+
+    def __finish_sample(self, sample: str) -> None:
+        self.__drop_inputs(sample)
+        # The workdir holds journaled intermediates until quantification succeeded, so a resume can reuse them
+        if self.scratch is not None and not self.ext_qc and sample in self.quantified:
+            rmtree(self.__workdir(sample), ignore_errors=True)
+        self.metrics.sample_finished(sample)
 
         pass
 
-    def __run_single(self) -> None:
+    def __sample_reads(self, sample: str) -> list:
+        if self.single:
+            return [f"{sample}{self.format}"]
+
+        return [f"{sample}{complement}{self.format}" for complement in self.complement]
+
+    def __run_samples(self) -> None:
         """
-        Run single-ended analysis using current tools
-        :return: Writes quality control, trimmed plus quality control and kallisto abundance/BAM results
+        Run the configured backends of every stage for single or paired-ended samples
+        :return: Writes quality control, trimmed plus quality control and quantification results
         """
+        qc = self.backends.get("qc")
+        trimmer = self.backends["trim"]
+        quantifier = self.backends["quant"]
+
         for sample in self.samples:
-            qc = run(
-                [
-                    "fastqc",
-                    "-o",
-                    f"{self.output}1_quality_control",
-                    "--no-extract",
-                    f"{self.input}{sample}{self.format}",
-                ],
-                capture_output=True,
-                text=True,
+            reads = self.__sample_reads(sample)
+            raw = [f"{self.input}{read}" for read in reads]
+            trimmed_dir = self.__local_dir(sample, trimmer.folder)
+            trimmed = trimmer.outputs(trimmed_dir, reads)
+
+            if qc is not None:
+                self.__run_stage(
+                    qc.stage,
+                    sample,
+                    f"{self.output}{qc.folder}",
+                    lambda staging: qc.command(staging, sample, self.__stage_inputs(sample, reads)),
+                    inputs=raw,
+                )
+
+            self.__run_stage(
+                trimmer.stage,
+                sample,
+                f"{self.output}{trimmer.folder}",
+                lambda staging: trimmer.command(staging, sample, self.__stage_inputs(sample, reads)),
+                intermediates=trimmer.intermediates,
+                local=trimmed_dir,
+                inputs=raw,
             )
-            self.logger.info(qc.stdout)
-            self.logger.info(qc.stderr)
-
-            trim = run(
-                [
-                    "trim_galore",
-                    "--quality",
-                    self.quality,
-                    "--fastqc",
-                    "--length",
-                    self.min_len,
-                    "-o",
-                    f"{self.output}2_trimmed_output",
-                    f"{self.input}{sample}{self.format}",
-                ],
-                capture_output=True,
-                text=True,
+            self.__drop_inputs(sample)
+
+            quantified = self.__run_stage(
+                quantifier.stage,
+                sample,
+                f"{self.output}{quantifier.folder}/{sample}",
+                lambda staging: quantifier.command(staging, sample, trimmed),
+                intermediates=quantifier.intermediates,
+                local=self.__local_dir(sample, f"{quantifier.folder}/{sample}"),
+                inputs=trimmed,
             )
-            self.logger.info(trim.stdout)
-            self.logger.info(trim.stderr)
+            if quantified:
+                self.__release(trimmer.stage, sample, trimmed)
+                self.quantified.add(sample)
 
-            run(
-                ["mkdir", "-p", f"results_{self.curr_time}/3_kallisto_results/{sample}"]
-            )
-
-            kall = run(
-                [
-                    "kallisto",
-                    "quant",
-                    "-t",
-                    self.threads[0],
-                    "-b",
-                    self.bootstrap[0],
-                    "--pseudobam",
-                    "--single",
-                    "-i",
-                    f"index/{self.index[0]}",
-                    "-o",
-                    f"{self.output}3_kallisto_results/{sample}",
-                    f"{self.output}2_trimmed_output/{sample}_trimmed.fq.gz",
-                ],
-                capture_output=True,
-                text=True,
-            )
-            self.logger.info(kall.stdout)
-            self.logger.info(kall.stderr)
+            self.__finish_sample(sample)
 
         pass
 
@@ -343,7 +500,7 @@ class PipelineCreator:
                     ["ls", f"{self.input}/"], capture_output=True, text=True
                 ).stdout.split("\n")
             )
-            results.update({format: value})
+            results.update({file_format: value})
 
         self.format = str(max(results, key=results.get))
 
@@ -356,10 +513,145 @@ class PipelineCreator:
         pass
 
     def __build_directory(self) -> None:
-        makedirs(f"{self.output}1_quality_control")
-        makedirs(f"{self.output}2_trimmed_output")
-        makedirs(f"{self.output}3_kallisto_results")
-        makedirs(f"{self.output}4_picard_qc")
+        resuming = self.resume is not None
+        makedirs(f"{self.output}1_quality_control", exist_ok=resuming)
+        makedirs(f"{self.output}2_trimmed_output", exist_ok=resuming)
+        makedirs(f"{self.output}3_kallisto_results", exist_ok=resuming)
+        makedirs(f"{self.output}4_picard_qc", exist_ok=resuming)
+
+        pass
+
+    def __start_journal(self) -> None:
+        if self.journal is None:
+            self.journal = RunJournal(output=self.output, logger=self.logger)
+
+            if self.resume is not None:
+                # Partial outputs of stages interrupted mid-run are never moved out of staging
+                for staging in Path(self.output).glob(".staging_*"):
+                    rmtree(staging, ignore_errors=True)
+                self.journal.load()
+                if self.scratch is not None:
+                    self.__clean_scratch()
+
+        pass
+
+    def __clean_scratch(self) -> None:
+        """
+        Remove what interrupted runs of this results folder left on scratch: staging folders in the current
+        workdirs and workdirs under any other name (e.g. from older versions) holding journaled outputs
+        :return: None
+        """
+        scratch = Path(self.scratch).resolve()
+        current = {Path(self.__workdir(sample)).name for sample in self.samples}
+        for name in current:
+            for staging in (scratch / name).glob(".staging_*"):
+                rmtree(staging, ignore_errors=True)
+
+        stale = set()
+        for file in self.journal.external:
+            try:
+                stale.add(Path(file).relative_to(scratch).parts[0])
+            except ValueError:
+                continue
+        for name in sorted(stale - current):
+            if name.startswith("minpipe_"):
+                rmtree(scratch / name, ignore_errors=True)
+                self.logger.info(f"Removed stale scratch folder {scratch / name}")
+
+        pass
+
+    def __backend_classes(self) -> dict:
+        trimmer = BACKENDS["trim"][self.trim]
+        assert (
+            not self.ext_qc or BACKENDS["quant"][self.quant].pseudobam
+        ), f"Extensive QC needs pseudoalignment BAMs, which `--quant {self.quant}` does not write. Use `--quant kallisto`."
+        classes = {
+            "qc": BACKENDS["qc"]["fastqc"],
+            "trim": trimmer,
+            "quant": BACKENDS["quant"][self.quant],
+        }
+        if trimmer.fused_qc:
+            classes.pop("qc")
+
+        return classes
+
+    def __start_backends(self) -> None:
+        if self.backends is None:
+            options = {
+                "single": self.single,
+                "format": self.format,
+                "quality": self.quality,
+                "min_len": self.min_len,
+                "threads": self.threads,
+                "bootstrap": self.bootstrap,
+                "index": self.__index_name(),
+                "pseudobam": self.ext_qc or self.keep_intermediates,
+            }
+            self.backends = {
+                role: backend(options) for role, backend in self.__backend_classes().items()
+            }
+
+        pass
+
+    def __index_name(self) -> str:
+        """
+        Name of the index file inside `index/`, from `--index` (str) or from the index built with `--transcript`
+        (list of "index/NAME.idx")
+        :return: Name without the `index/` folder, None if no index is known yet
+        """
+        index = self.index[0] if isinstance(self.index, list) else self.index
+        if not index:
+            return None
+
+        return index[len("index/"):] if index.startswith("index/") else index
+
+    def __index_size(self) -> int:
+        index = self.__index_name()
+        index_path = Path(f"index/{index}")
+
+        return index_path.stat().st_size if index and index_path.is_file() else 0
+
+    def __build_plan(self) -> ExecutionPlan:
+        if self.cost_model is None:
+            self.cost_model = CostModel(logger=self.logger)
+
+        return ExecutionPlan(
+            model=self.cost_model,
+            backends=self.__backend_classes(),
+            samples={
+                sample: [f"{self.input}{read}" for read in self.__sample_reads(sample)]
+                for sample in self.samples
+            },
+            threads=self.threads,
+            index_size=self.__index_size(),
+        )
+
+    def plan(self) -> ExecutionPlan:
+        """
+        Dry run: predict the cost of every stage of every sample without running anything
+        :return: The plan, after printing its report
+        """
+        if self.format is None:
+            self.__decide_format()
+        if self.input[-1] != "/":
+            self.input += "/"
+
+        plan = self.__build_plan()
+        cores, memory_mb = machine_resources()
+        print("\n".join(plan.report(cores, memory_mb)))
+
+        return plan
+
+    def __start_metrics(self) -> None:
+        if self.metrics is None:
+            self.metrics = ProgressMetrics(
+                output=self.output,
+                samples=self.samples,
+                stages=[backend.stage for backend in self.backends.values()],
+                logger=self.logger,
+                port=self.metrics_port,
+            )
+            self.metrics.start()
 
         pass
 
@@ -369,18 +661,34 @@ class PipelineCreator:
         :return: None
         """
         self.__start_log()
+        self.__start_journal()
+        self.__start_backends()
 
-        if not self.single:
-            self.__run_paired()
-        elif self.single:
-            self.__run_single()
+        self.samples = self.__build_plan().order()
+        self.logger.info(f"Samples ordered by predicted cost: {self.samples}")
+        self.__start_metrics()
+
+        try:
+            self.__run_samples()
+        finally:
+            self.metrics.stop()
 
         if self.ext_qc:
+            quant_folder = self.backends["quant"].folder
+            bams = {
+                sample: f"{self.__local_dir(sample, f'{quant_folder}/{sample}')}/pseudoalignments.bam"
+                for sample in self.samples
+            }
             qc = ExtensiveQC(
-                samples=self.samples, output=self.output, logger=self.logger
+                samples=self.samples, output=self.output, logger=self.logger, bams=bams
             )
             qc.run_all()
 
+            for sample in self.samples:
+                self.__release(self.backends["quant"].stage, sample, [bams[sample]])
+                if self.scratch is not None and sample in self.quantified:
+                    rmtree(self.__workdir(sample), ignore_errors=True)
+
         self.logger.info("Finished pseudoalignment!")
 
         pass
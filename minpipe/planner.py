@@ -0,0 +1,202 @@
+from pathlib import Path
+from statistics import median
+import logging
+import json
+import os
+
+HISTORY = "minpipe_history.json"
+# Trimmed reads are usually slightly smaller than the raw reads
+TRIMMED_RATIO = 0.9
+
+
+class CostModel:
+    def __init__(self, path: str = HISTORY, logger: logging.Logger = None) -> None:
+        """
+        Per-stage cost estimates from the throughput and memory recorded by earlier runs, falling back to the
+        priors of each backend when a stage has no history yet.
+
+        :type path: str
+        :type logger: logging.Logger
+        """
+        self.path = path
+        self.logger = logger
+        self.history = {}
+        if Path(self.path).is_file():
+            with open(self.path) as fd:
+                self.history = json.load(fd)
+        pass
+
+    def record(
+        self, stage: str, size: int, seconds: float, threads: int, peak_mb: float, index_size: int = 0
+    ) -> None:
+        runs = self.history.setdefault(stage, [])
+        runs.append(
+            {
+                "bytes": size,
+                "seconds": seconds,
+                "threads": threads,
+                "peak_mb": peak_mb,
+                "index_bytes": index_size,
+            }
+        )
+        # Recent runs describe the current machine best
+        del runs[:-50]
+
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as fd:
+            json.dump(self.history, fd, indent=4)
+        os.replace(tmp, self.path)
+
+        pass
+
+    @staticmethod
+    def speedup(backend, threads: int) -> float:
+        # Amdahl's law with the fraction of the stage that scales with threads
+        return 1 / ((1 - backend.parallel) + backend.parallel / max(int(threads), 1))
+
+    def throughput(self, backend) -> float:
+        """
+        Single thread bytes per second of a stage
+        :return: Median of the recorded runs or the backend prior
+        """
+        runs = [
+            run["bytes"] / (run["seconds"] * self.speedup(backend, run["threads"]))
+            for run in self.history.get(backend.stage, [])
+            if run["seconds"] > 0 and run["bytes"] > 0
+        ]
+
+        return median(runs) if runs else backend.throughput
+
+    def stage_seconds(self, backend, size: int, threads: int) -> float:
+        return size / (self.throughput(backend) * self.speedup(backend, threads))
+
+    def stage_memory(self, backend, index_size: int = 0) -> float:
+        """
+        Peak resident memory of a stage in MB
+        :return: Highest recorded peak rescaled to the size of the index, or the backend prior
+        """
+        # Recorded peaks less the share of the index they were run with, as a smaller index needs less memory
+        base = [
+            run["peak_mb"] - backend.index_memory * run.get("index_bytes", 0) / 1e6
+            for run in self.history.get(backend.stage, [])
+            if "index_bytes" in run or not backend.index_memory
+        ]
+        memory = max(max(base), 0) if base else backend.memory
+
+        return memory + backend.index_memory * index_size / 1e6
+
+
+class ExecutionPlan:
+    def __init__(
+        self,
+        model: CostModel,
+        backends: dict,
+        samples: dict,
+        threads: int,
+        index_size: int = 0,
+    ) -> None:
+        """
+        Stage graph of every sample (qc -> trim -> quant) with predicted cost.
+
+        :param backends: stage role -> backend class, as selected for the run
+        :param samples: sample -> paths of its raw reads
+        :type model: CostModel
+        :type threads: int
+        :type index_size: int
+        """
+        self.model = model
+        self.backends = backends
+        self.samples = samples
+        self.threads = int(threads)
+        self.index_size = index_size
+        pass
+
+    def stage_inputs(self, sample: str) -> dict:
+        raw = sum(Path(read).stat().st_size for read in self.samples[sample] if Path(read).is_file())
+        sizes = {role: raw for role in self.backends}
+        if "quant" in sizes:
+            sizes["quant"] = int(raw * TRIMMED_RATIO)
+
+        return sizes
+
+    def sample_seconds(self, sample: str, threads: int = None) -> float:
+        threads = self.threads if threads is None else threads
+        sizes = self.stage_inputs(sample)
+
+        return sum(
+            self.model.stage_seconds(backend, sizes[role], threads)
+            for role, backend in self.backends.items()
+        )
+
+    def total_seconds(self, threads: int = None) -> float:
+        return sum(self.sample_seconds(sample, threads) for sample in self.samples)
+
+    def peak_memory(self) -> float:
+        return max(self.model.stage_memory(b, self.index_size) for b in self.backends.values())
+
+    def order(self) -> list:
+        """
+        Samples sorted by predicted cost, shortest first, so finished results and ETA data arrive early
+        :return: Ordered sample names
+        """
+        return sorted(self.samples, key=self.sample_seconds)
+
+    def recommend(self, cores: int, memory_mb: float) -> dict:
+        """
+        Smallest thread count within 5% of the fastest predicted run, and how many such runs fit the machine
+        :return: Dictionary with threads, concurrent runs and predicted seconds
+        """
+        best = self.total_seconds(cores)
+        threads = next(t for t in range(1, cores + 1) if self.total_seconds(t) <= best * 1.05)
+        runs = max(min(cores // threads, int(memory_mb // max(self.peak_memory(), 1))), 1)
+
+        return {"threads": threads, "runs": runs, "seconds": self.total_seconds(threads)}
+
+    def report(self, cores: int, memory_mb: float) -> list:
+        lines = ["# # # # # # # # # # # # # # #", "# Execution plan", "# # # # # # # # # # # # # # #"]
+        for sample in self.order():
+            sizes = self.stage_inputs(sample)
+            stages = ", ".join(
+                f"{backend.stage} {self.model.stage_seconds(backend, sizes[role], self.threads):.0f}s"
+                for role, backend in self.backends.items()
+            )
+            lines.append(f"{sample} ({sizes[next(iter(sizes))] / 1e6:.0f} MB): {stages}")
+
+        for backend in self.backends.values():
+            source = "history" if self.model.history.get(backend.stage) else "default prior"
+            lines.append(
+                f"Stage {backend.stage}: {self.model.throughput(backend) / 1e6:.1f} MB/s per thread "
+                f"({source}), peak {self.model.stage_memory(backend, self.index_size):.0f} MB"
+            )
+
+        rec = self.recommend(cores, memory_mb)
+        lines += [
+            f"Predicted wall time with {self.threads} threads: {self.total_seconds() / 60:.1f} min",
+            f"Predicted peak memory: {self.peak_memory():.0f} MB of {memory_mb:.0f} MB available",
+            f"Machine: {cores} cores",
+            f"Recommended: --threads {rec['threads']} ({rec['seconds'] / 60:.1f} min)",
+            f"Samples are run one at a time. Concurrent runs on separate sample subsets that fit this "
+            f"machine: {rec['runs']}",
+        ]
+        if self.peak_memory() > memory_mb:
+            lines.append("WARNING: predicted peak memory is higher than the available memory.")
+
+        return lines
+
+
+def machine_resources() -> tuple:
+    """
+    Available cores and available memory in MB
+    """
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    memory_mb = None
+    if Path("/proc/meminfo").is_file():
+        # MemAvailable counts the page cache that can be reclaimed, unlike the free pages
+        with open("/proc/meminfo") as fd:
+            for line in fd:
+                if line.startswith("MemAvailable:"):
+                    memory_mb = int(line.split()[1]) * 1024 / 1e6
+    if memory_mb is None:
+        memory_mb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES") / 1e6
+
+    return cores, memory_mb
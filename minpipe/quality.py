@@ -4,11 +4,16 @@ import logging
 # TODO: variant calling for each sample
 class ExtensiveQC:
     def __init__(
-        self, samples: list, output: str, logger: logging.Logger = None
+        self, samples: list, output: str, logger: logging.Logger = None, bams: dict = None
     ) -> None:
         self.samples = samples
         self.output = output
         self.logger = logger
+        # Pseudoalignments may be kept on scratch storage instead of the results folder
+        self.bams = bams if bams is not None else {
+            sample: f"{output}3_kallisto_results/{sample}/pseudoalignments.bam"
+            for sample in samples
+        }
         pass
 
     def QualityScoreDist(self):
@@ -18,7 +23,7 @@ class ExtensiveQC:
                     "picard",
                     "QualityScoreDistribution",
                     "-I",
-                    f"{self.output}3_kallisto_results/{sample}/pseudoalignments.bam",
+                    self.bams[sample],
                     "-O",
                     f"{self.output}4_picard_qc/{sample}.txt",
                     "-CHART",
@@ -0,0 +1,327 @@
+"""
+Lightweight k-mer pseudoalignment used as an in-process alternative to kallisto for quick screening and
+small panels. It only needs the Python standard library.
+
+The index is a single file memory-mapped at quantification time:
+    header | sorted canonical k-mers (u64) | equivalence class of each k-mer (u32)
+           | equivalence class offsets (u64) | equivalence class members (u32) | target lengths (u32) | names
+
+Usage:
+    python quickquant.py index -i index/panel.quick.idx -k 31 transcripts.fa.gz
+    python quickquant.py quant -i index/panel.quick.idx -o out/ -t 4 [--single] reads_1.fq.gz [reads_2.fq.gz]
+"""
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import islice
+from multiprocessing import Pool
+from pathlib import Path
+import argparse
+import gzip
+import json
+import mmap
+import struct
+import sys
+
+MAGIC = b"MPQI"
+VERSION = 1
+HEADER = struct.Struct("<4sIIIQQQ")
+HEADER_SIZE = 64
+CODES = {"A": 0, "C": 1, "G": 2, "T": 3, "a": 0, "c": 1, "g": 2, "t": 3}
+
+
+def open_text(file: str):
+    if str(file).endswith(".gz"):
+        return gzip.open(file, "rt")
+
+    return open(file)
+
+
+def canonical_kmers(seq: str, k: int):
+    """
+    Yield the 2-bit encoded canonical k-mers of a sequence, restarting after any non ACGT base
+    """
+    mask = (1 << (2 * k)) - 1
+    shift = 2 * (k - 1)
+    fwd = rev = size = 0
+    for base in seq:
+        code = CODES.get(base)
+        if code is None:
+            fwd = rev = size = 0
+            continue
+        fwd = ((fwd << 2) | code) & mask
+        rev = (rev >> 2) | ((3 - code) << shift)
+        size += 1
+        if size >= k:
+            yield fwd if fwd < rev else rev
+
+
+def read_fasta(file: str):
+    name, seq = None, []
+    with open_text(file) as fd:
+        for line in fd:
+            if line.startswith(">"):
+                if name is not None:
+                    yield name, "".join(seq)
+                name, seq = line[1:].split()[0], []
+            else:
+                seq.append(line.strip())
+    if name is not None:
+        yield name, "".join(seq)
+
+
+def read_fastq(file: str):
+    with open_text(file) as fd:
+        while True:
+            record = list(islice(fd, 4))
+            if len(record) < 4:
+                return
+            yield record[1].strip()
+
+
+def _pad(fd) -> None:
+    fd.write(b"\0" * (-fd.tell() % 8))
+
+
+def build_index(fasta: str, path: str, k: int = 31) -> None:
+    """
+    Build a k-mer -> equivalence class index from a transcript FASTA (plain or gzipped)
+    :return: Writes the index to `path`
+    """
+    if not 1 <= k <= 31 or k % 2 == 0:
+        raise ValueError(f"k has to be an odd number up to 31. Passed `{k}`")
+
+    names, lengths, kmer_targets = [], [], {}
+    for target, (name, seq) in enumerate(read_fasta(fasta)):
+        names.append(name)
+        lengths.append(len(seq))
+        for kmer in canonical_kmers(seq, k):
+            targets = kmer_targets.setdefault(kmer, [])
+            if not targets or targets[-1] != target:
+                targets.append(target)
+
+    ec_ids, ec_offsets, ec_members = {}, array("Q", [0]), array("I")
+    kmers = array("Q", sorted(kmer_targets))
+    kmer_ec = array("I")
+    for kmer in kmers:
+        members = tuple(kmer_targets.pop(kmer))
+        ec = ec_ids.get(members)
+        if ec is None:
+            ec = ec_ids[members] = len(ec_ids)
+            ec_members.extend(members)
+            ec_offsets.append(len(ec_members))
+        kmer_ec.append(ec)
+
+    with open(path, "wb") as fd:
+        fd.write(
+            HEADER.pack(MAGIC, VERSION, k, len(names), len(kmers), len(ec_ids), len(ec_members))
+        )
+        fd.write(b"\0" * (HEADER_SIZE - HEADER.size))
+        for section in [kmers, kmer_ec, ec_offsets, ec_members, array("I", lengths)]:
+            section.tofile(fd)
+            _pad(fd)
+        fd.write("\n".join(names).encode())
+
+    pass
+
+
+class QuickIndex:
+    def __init__(self, path: str) -> None:
+        """
+        Memory-mapped view of an index written by `build_index`
+
+        :type path: str
+        """
+        self.path = path
+        self.fd = open(path, "rb")
+        self.buffer = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.k, n_targets, n_kmers, n_ec, n_members = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a MinPipe quick-quant index.")
+
+        view = memoryview(self.buffer)
+        offset = HEADER_SIZE
+        sections = []
+        for fmt, size in [("Q", n_kmers), ("I", n_kmers), ("Q", n_ec + 1), ("I", n_members), ("I", n_targets)]:
+            end = offset + size * struct.calcsize(fmt)
+            sections.append(view[offset:end].cast(fmt))
+            offset = end + (-end % 8)
+        self.kmers, self.kmer_ec, self.ec_offsets, self.ec_members, self.lengths = sections
+        self.names = bytes(view[offset:]).decode().split("\n") if n_targets else []
+        self.ec_cache = {}
+        pass
+
+    def targets(self, ec: int) -> frozenset:
+        members = self.ec_cache.get(ec)
+        if members is None:
+            start, end = self.ec_offsets[ec], self.ec_offsets[ec + 1]
+            members = self.ec_cache[ec] = frozenset(self.ec_members[start:end])
+
+        return members
+
+    def lookup(self, kmer: int) -> int:
+        pos = bisect_left(self.kmers, kmer)
+        if pos < len(self.kmers) and self.kmers[pos] == kmer:
+            return self.kmer_ec[pos]
+
+        return -1
+
+    def pseudoalign(self, reads: tuple):
+        """
+        Intersect the equivalence classes of every k-mer found in the read (or both mates)
+        :return: Sorted tuple of compatible targets or None if the read does not pseudoalign
+        """
+        compatible, last = None, -1
+        for seq in reads:
+            for kmer in canonical_kmers(seq, self.k):
+                ec = self.lookup(kmer)
+                if ec < 0 or ec == last:
+                    continue
+                last = ec
+                compatible = self.targets(ec) if compatible is None else compatible & self.targets(ec)
+                if not compatible:
+                    return None
+
+        return tuple(sorted(compatible)) if compatible else None
+
+
+_worker_index = None
+
+
+def _init_worker(path: str) -> None:
+    global _worker_index
+    _worker_index = QuickIndex(path)
+
+
+def _align_chunk(chunk: list):
+    counts = Counter()
+    for reads in chunk:
+        targets = _worker_index.pseudoalign(reads)
+        if targets is not None:
+            counts[targets] += 1
+
+    return len(chunk), counts
+
+
+def em(counts: Counter, eff_lengths: list, rounds: int = 10000, tolerance: float = 1e-2) -> list:
+    """
+    Expectation maximization of read counts per target from the equivalence class counts
+    :return: Estimated counts per target
+    """
+    n_targets = len(eff_lengths)
+    alpha = [1.0 / n_targets] * n_targets
+    classes = list(counts.items())
+    for _ in range(rounds):
+        updated = [0.0] * n_targets
+        for targets, count in classes:
+            weights = [alpha[t] / eff_lengths[t] for t in targets]
+            total = sum(weights)
+            if total <= 0:
+                continue
+            for t, weight in zip(targets, weights):
+                updated[t] += count * weight / total
+        converged = all(
+            abs(new - old) <= tolerance * max(new, 1e-8) for new, old in zip(updated, alpha) if new > 1e-8
+        )
+        alpha = updated
+        if converged:
+            break
+
+    return alpha
+
+
+def quantify(
+    index: str,
+    reads: list,
+    output: str,
+    threads: int = 1,
+    single: bool = False,
+    fragment_length: float = 200,
+    chunk_size: int = 10000,
+) -> None:
+    """
+    Pseudoalign reads in parallel and write abundance.tsv and run_info.json in the same layout as kallisto
+    :return: None
+    """
+    idx = QuickIndex(index)
+    streams = [read_fastq(file) for file in (reads[:1] if single else reads)]
+    pairs = zip(*streams)
+
+    def chunks():
+        while True:
+            chunk = list(islice(pairs, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    counts, processed = Counter(), 0
+    with Pool(int(threads), initializer=_init_worker, initargs=(index,)) as pool:
+        for size, partial in pool.imap_unordered(_align_chunk, chunks()):
+            processed += size
+            counts.update(partial)
+            print(f"[quant] processed {processed:,} reads", flush=True)
+
+    aligned = sum(counts.values())
+    print(f"[quant] processed {processed:,} reads, {aligned:,} reads pseudoaligned", flush=True)
+
+    eff_lengths = [max(length - fragment_length + 1, 1.0) for length in idx.lengths]
+    est_counts = em(counts, eff_lengths) if counts else [0.0] * len(eff_lengths)
+    rates = [c / e for c, e in zip(est_counts, eff_lengths)]
+    total = sum(rates) or 1.0
+
+    Path(output).mkdir(parents=True, exist_ok=True)
+    with open(Path(output) / "abundance.tsv", "w") as fd:
+        fd.write("target_id\tlength\teff_length\test_counts\ttpm\n")
+        for name, length, eff, count, rate in zip(idx.names, idx.lengths, eff_lengths, est_counts, rates):
+            fd.write(f"{name}\t{length}\t{eff:g}\t{count:g}\t{rate / total * 1e6:g}\n")
+
+    with open(Path(output) / "run_info.json", "w") as fd:
+        json.dump(
+            {
+                "n_targets": len(idx.names),
+                "n_processed": processed,
+                "n_pseudoaligned": aligned,
+                "p_pseudoaligned": round(100 * aligned / processed, 1) if processed else 0.0,
+                "index_version": VERSION,
+                "call": " ".join(sys.argv),
+            },
+            fd,
+            indent=4,
+        )
+
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quick k-mer pseudoalignment without external tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index = commands.add_parser("index", help="Build an index from a transcript FASTA.")
+    index.add_argument("-i", "--index", required=True, help="Path of the index to be written.")
+    index.add_argument("-k", "--kmer-size", type=int, default=31, help="Odd k-mer size up to 31. Default: 31.")
+    index.add_argument("fasta", help="Transcript FASTA, plain or gzipped.")
+
+    quant = commands.add_parser("quant", help="Quantify reads against an index.")
+    quant.add_argument("-i", "--index", required=True, help="Path of the index.")
+    quant.add_argument("-o", "--output", required=True, help="Folder for abundance.tsv and run_info.json.")
+    quant.add_argument("-t", "--threads", type=int, default=1, help="Number of processes. Default: 1.")
+    quant.add_argument("-l", "--fragment-length", type=float, default=200, help="Mean fragment length. Default: 200.")
+    quant.add_argument("--single", action="store_true", help="Flag for single-ended reads.")
+    quant.add_argument("reads", nargs="+", help="FASTQ files, plain or gzipped.")
+
+    args = parser.parse_args()
+    if args.command == "index":
+        build_index(args.fasta, args.index, k=args.kmer_size)
+    else:
+        quantify(
+            args.index,
+            args.reads,
+            args.output,
+            threads=args.threads,
+            single=args.single,
+            fragment_length=args.fragment_length,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+from hashlib import blake2b
+from shutil import which
+from subprocess import Popen, PIPE
+import logging
+import gzip
+
+from annotation import parse_header
+
+
+class TranscriptomePreprocessor:
+    def __init__(
+        self,
+        logger: logging.Logger,
+        biotypes: list = None,
+        chromosomes: list = None,
+    ) -> None:
+        """
+        Clean a transcript FASTA before indexing in a single streaming pass: drop transcripts with a sequence
+        already seen, transcripts outside the wanted biotypes and transcripts outside the wanted chromosomes
+        (patch and haplotype CHR_* sequences when no chromosome is given).
+
+        :type logger: logging.Logger
+        :type biotypes: list
+        :type chromosomes: list
+        """
+        self.logger = logger
+        self.biotypes = set(biotypes) if biotypes else None
+        self.chromosomes = set(chromosomes) if chromosomes else None
+        pass
+
+    def __stream(self, fasta: str):
+        """
+        Decompress in a separate process so parsing overlaps with decompression. Gzip decompression is
+        sequential, pigz is only preferred for its faster reading and checking
+        :return: Text lines of the FASTA
+        """
+        if not fasta.endswith(".gz"):
+            with open(fasta) as fd:
+                yield from fd
+            return
+
+        if which("pigz"):
+            cmd = ["pigz", "-dc", fasta]
+        elif which("gzip"):
+            cmd = ["gzip", "-dc", fasta]
+        else:
+            with gzip.open(fasta, "rt") as fd:
+                yield from fd
+            return
+
+        with Popen(cmd, stdout=PIPE, text=True, bufsize=1 << 20) as proc:
+            yield from proc.stdout
+        if proc.returncode != 0:
+            raise RuntimeError(f"Decompression of {fasta} failed with code {proc.returncode}.")
+
+    def __records(self, fasta: str):
+        header, seq = None, []
+        for line in self.__stream(fasta):
+            if line.startswith(">"):
+                if header is not None:
+                    yield header, "".join(seq)
+                header, seq = line.rstrip("\n"), []
+            else:
+                seq.append(line.strip().upper())
+        if header is not None:
+            yield header, "".join(seq)
+
+    def __keep(self, row: dict) -> str:
+        # Reason for dropping a transcript, empty if it is kept
+        if self.biotypes is not None and row["transcript_biotype"] not in self.biotypes:
+            return "biotype"
+        if self.chromosomes is not None:
+            if row["chromosome"] not in self.chromosomes:
+                return "chromosome"
+        elif row["chromosome"].startswith("CHR_"):
+            return "chromosome"
+
+        return ""
+
+    def run(self, fasta: str, output: str, duplicates: str) -> list:
+        """
+        Write the cleaned FASTA and the table of removed duplicates with the transcript kept in their place
+        :return: Annotation rows of every transcript in the input, including the removed ones
+        """
+        seen, rows = {}, []
+        stats = {"total": 0, "kept": 0, "duplicate": 0, "biotype": 0, "chromosome": 0}
+
+        with open(output, "w") as out, open(duplicates, "w") as dup:
+            dup.write("removed_id\tkept_id\n")
+            for header, seq in self.__records(fasta):
+                row = parse_header(header)
+                rows.append(row)
+                stats["total"] += 1
+
+                reason = self.__keep(row)
+                if reason:
+                    stats[reason] += 1
+                    continue
+
+                digest = blake2b(seq.encode(), digest_size=16).digest()
+                kept = seen.get(digest)
+                if kept is not None:
+                    stats["duplicate"] += 1
+                    dup.write(f"{row['target_id']}\t{kept}\n")
+                    continue
+
+                seen[digest] = row["target_id"]
+                stats["kept"] += 1
+                out.write(f"{header}\n{seq}\n")
+
+        self.logger.info(
+            f"Transcriptome preprocessed: {stats['kept']} of {stats['total']} transcripts kept, "
+            f"{stats['duplicate']} duplicates, {stats['biotype']} filtered by biotype and "
+            f"{stats['chromosome']} filtered by chromosome."
+        )
+
+        return rows